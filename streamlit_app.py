@@ -2,14 +2,29 @@
 
 import streamlit as st
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+import httpx
 import os
-import json
+import hashlib
+import asyncio
+import contextvars
+import queue
+import threading
+import logging
+from functools import partial
+import orjson
 from datetime import datetime
-from utils.methodology_handler import MethodologyHandler
-from utils.pdf_parser import extract_text_from_pdf
+from utils.methodology_handler import MethodologyHandler, corpus_key
+from utils.prompts import SYS_EXTRACTOR, SYS_PLANNER, build_facts_prompt, build_plan_section_prompt
+from utils.batch_runner import read_cases_csv, submit_batch, fetch_batch_results, TERMINAL_STATUSES
 from pathlib import Path
 
+# Настройка логирования (однократно для всего приложения)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
 # Инициализация настроек
 if 'openai_client' not in st.session_state:
     st.session_state.openai_client = None
@@ -17,6 +32,9 @@ if 'openai_client' not in st.session_state:
 if 'methodology_handler' not in st.session_state:
     st.session_state.methodology_handler = None
 
+if 'batch_id' not in st.session_state:
+    st.session_state.batch_id = None
+
 # Настройка страницы
 st.set_page_config(
     page_title="Система планирования расследований",
@@ -58,6 +76,124 @@ def create_directories():
         st.error(f"Ошибка при создании директорий: {str(e)}")
         raise
 
+# Каталог векторных индексов методик, по подкаталогу на SHA256 содержимого PDF
+INDEX_ROOT = Path("storage/methodologies/index")
+
+# Каталог индекса последней загруженной методики
+def latest_index_dir():
+    if not INDEX_ROOT.exists():
+        return None
+    index_dirs = [
+        path for path in INDEX_ROOT.iterdir()
+        if path.is_dir() and not path.name.endswith(".tmp")
+    ]
+    if not index_dirs:
+        return None
+    return str(max(index_dirs, key=lambda path: path.stat().st_mtime))
+
+# Пул соединений HTTP/2 с keep-alive, чтобы не повторять TLS рукопожатие на каждый запрос
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+# Синхронный клиент OpenAI общий для всех сессий и перезапусков скрипта
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key: str) -> OpenAI:
+    return OpenAI(
+        api_key=api_key,
+        http_client=DefaultHttpxClient(http2=True, limits=HTTP_LIMITS)
+    )
+
+# Обработчик методики (embeddings и FAISS индекс) общий для всех сессий
+@st.cache_resource(show_spinner=False)
+def get_methodology_handler(api_key: str, index_path: str = None) -> MethodologyHandler:
+    handler = MethodologyHandler(api_key=api_key)
+    if index_path and Path(index_path).exists():
+        handler.load_index(index_path)
+    return handler
+
+# Цикл событий общий для всего процесса и работает в фоновом потоке: пул
+# соединений AsyncOpenAI привязан к циклу, поэтому клиент и цикл живут вместе
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="openai-event-loop", daemon=True).start()
+    return loop
+
+# Асинхронный клиент OpenAI общий для всех сессий, создаётся в общем цикле событий
+@st.cache_resource(show_spinner=False)
+def get_async_openai_client(api_key: str) -> AsyncOpenAI:
+    async def create():
+        return AsyncOpenAI(
+            api_key=api_key,
+            http_client=DefaultAsyncHttpxClient(http2=True, limits=HTTP_LIMITS)
+        )
+    return asyncio.run_coroutine_threadsafe(create(), get_event_loop()).result()
+
+# Количество чанков между обновлениями интерфейса при потоковой выдаче
+STREAM_UPDATE_EVERY = 8
+
+# Очередь вызовов Streamlit текущего run_async. Элементы страницы можно менять
+# только из потока сценария, поэтому корутины передают вызовы через неё
+_ui_calls: contextvars.ContextVar = contextvars.ContextVar("ui_calls", default=None)
+
+# Вызов функции Streamlit из корутины: выполняется в потоке сценария
+def call_in_script_thread(fn, *args):
+    calls = _ui_calls.get()
+    if calls is None:
+        fn(*args)
+    else:
+        calls.put((fn, args))
+
+# Запуск корутины в общем цикле событий с выполнением её вызовов Streamlit
+def run_async(coro):
+    calls = queue.SimpleQueue()
+    # Контекст копируется в задачу при планировании, очередь видна корутине
+    token = _ui_calls.set(calls)
+    try:
+        future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    finally:
+        _ui_calls.reset(token)
+    future.add_done_callback(lambda _: calls.put(None))
+
+    try:
+        while (call := calls.get()) is not None:
+            fn, args = call
+            fn(*args)
+        return future.result()
+    except BaseException:
+        # Перезапуск скрипта (RerunException/StopException) прерывает ожидание:
+        # отменяем задачу, чтобы она не продолжала запросы для устаревшей страницы
+        future.cancel()
+        raise
+
+# Потоковый запрос к модели с периодическим обновлением интерфейса
+async def stream_completion(client, messages, max_tokens: int, temperature: float, on_update=None) -> str:
+    stream = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        timeout=20,
+        stream=True
+    )
+
+    buffer = ""
+    received = 0
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        buffer += delta
+        received += 1
+        # Перерисовываем не на каждый чанк, чтобы не перегружать интерфейс
+        if on_update and received % STREAM_UPDATE_EVERY == 0:
+            on_update(buffer)
+
+    if on_update:
+        on_update(buffer)
+    return buffer.strip()
+
 # Инициализация OpenAI клиента
 def init_openai(api_key):
     try:
@@ -65,42 +201,65 @@ def init_openai(api_key):
             st.error("API ключ не может быть пустым")
             return False
         
-        client = OpenAI(api_key=api_key)
-        st.session_state.openai_client = client
+        st.session_state.openai_client = get_async_openai_client(api_key)
         return True
     except Exception as e:
         st.error(f"Ошибка инициализации OpenAI: {str(e)}")
         return False
 
 # Извлечение фактов из описания
-def extract_facts(client, case_description: str) -> str:
+async def extract_facts(client, case_description: str, placeholder=None) -> str:
     try:
         if not case_description.strip():
             return "Ошибка: Описание дела не может быть пустым"
         
-        prompt = f"""
-        Проанализируй следующий текст фабулы дела и выдели ключевые факты (даты, события, участников, места, доказательства):
-        {case_description}
-        Ответ должен быть в виде списка пунктов.
-        """
         messages = [
-            {"role": "system", "content": "Ты опытный следователь который умеет выделять факты, события, участников, места и доказательства"},
-            {"role": "user", "content": prompt}
+            {"role": "system", "content": SYS_EXTRACTOR},
+            {"role": "user", "content": build_facts_prompt(case_description)}
         ]
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
+        return await stream_completion(
+            client,
+            messages,
             max_tokens=500,
             temperature=0.3,
-            timeout=20
+            on_update=partial(call_in_script_thread, placeholder.markdown) if placeholder else None
         )
-        return response.choices[0].message.content.strip()
     except Exception as e:
         return f"Ошибка при извлечении фактов: {str(e)}"
 
+# Разделы плана (заголовок -> задание). Каждый раздел формируется отдельным
+# небольшим запросом, все запросы выполняются параллельно
+PLAN_SECTIONS = {
+    "Основные направления проверки": "Сформулируй основные направления проверки и версии, которые необходимо отработать.",
+    "Приоритетные действия": "Перечисли первоочередные следственные действия в порядке приоритета с кратким обоснованием.",
+    "Рекомендуемые экспертизы": "Перечисли экспертизы, которые рекомендуется назначить, и основные вопросы экспертам.",
+}
+
+# Ограничение длины ответа для одного раздела плана
+PLAN_SECTION_MAX_TOKENS = 300
+
+# Сборка плана из разделов в порядке PLAN_SECTIONS
+def assemble_plan(sections) -> str:
+    return "\n\n".join(f"## {title}\n{text}" for title, text in zip(PLAN_SECTIONS, sections) if text)
+
+# Формирование одного раздела плана расследования
+async def create_plan_section(client, facts: str, instruction: str, methodology_context: str = "", on_update=None) -> str:
+    messages = [
+        {"role": "system", "content": SYS_PLANNER},
+        {"role": "user", "content": build_plan_section_prompt(facts, instruction, methodology_context)}
+    ]
+
+    return await stream_completion(
+        client,
+        messages,
+        max_tokens=PLAN_SECTION_MAX_TOKENS,
+        temperature=0.5,
+        on_update=on_update
+    )
+
 # Создание плана расследования
-def create_investigation_plan(client, facts: str, methodology_handler=None) -> str:
+async def create_investigation_plan(client, facts: str, methodology_handler=None, placeholder=None) -> str:
     try:
         if not facts.strip():
             return "Ошибка: Факты не могут быть пустыми"
@@ -109,29 +268,37 @@ def create_investigation_plan(client, facts: str, methodology_handler=None) -> s
         methodology_context = ""
         if methodology_handler:
             try:
-                methodology_context = methodology_handler.get_recommendations_context(facts)
+                # Поиск синхронный, выполняем вне общего цикла событий
+                methodology_context = await asyncio.to_thread(methodology_handler.get_recommendations_context, facts)
             except Exception as e:
-                st.warning(f"Не удалось получить рекомендации из методики: {str(e)}")
-
-        prompt = f"""
-        {methodology_context}
-        На основе следующих фактов составь план расследования, включающий основные направления проверки, приоритетные действия и рекомендуемые экспертизы:
-        Факты: {facts}
-        Ответ предоставь в виде структурированного плана.
-        """
-        messages = [
-            {"role": "system", "content": "Ты опытный следователь, умеющий планировать расследование, использующий самые современные методики расследования"},
-            {"role": "user", "content": prompt}
-        ]
+                call_in_script_thread(st.warning, f"Не удалось получить рекомендации из методики: {str(e)}")
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=900,
-            temperature=0.5,
-            timeout=20
-        )
-        return response.choices[0].message.content.strip()
+        # Текущее состояние каждого раздела для потокового отображения
+        sections_text = [""] * len(PLAN_SECTIONS)
+
+        def make_on_update(index):
+            if not placeholder:
+                return None
+
+            def on_update(text):
+                sections_text[index] = text
+                call_in_script_thread(placeholder.markdown, assemble_plan(sections_text))
+
+            return on_update
+
+        # Разделы плана независимы: несколько коротких ответов параллельно
+        # генерируются быстрее, чем один длинный
+        tasks = [
+            asyncio.ensure_future(create_plan_section(client, facts, instruction, methodology_context, make_on_update(i)))
+            for i, instruction in enumerate(PLAN_SECTIONS.values())
+        ]
+        try:
+            sections = await asyncio.gather(*tasks)
+        finally:
+            # При ошибке одного раздела или отмене плана остальные запросы не нужны
+            for task in tasks:
+                task.cancel()
+        return assemble_plan(sections)
     except Exception as e:
         return f"Ошибка при создании плана: {str(e)}"
 
@@ -145,11 +312,19 @@ with st.sidebar:
         st.success("API ключ действителен")
     else:
         st.error("Неверный или отсутствующий API ключ OpenAI")
+    
+    # Подключаем ранее сохранённый индекс методики
+    saved_index = latest_index_dir()
+    if api_key and st.session_state.methodology_handler is None and saved_index:
+        try:
+            st.session_state.methodology_handler = get_methodology_handler(api_key, saved_index)
+        except Exception as e:
+            st.warning(f"Не удалось загрузить сохранённую методику: {str(e)}")
         
     st.header("📚 Навигация")
     page = st.radio(
         "Выберите раздел:",
-        ["Настройка методики", "Планирование расследования"]
+        ["Настройка методики", "Планирование расследования", "Пакетная обработка"]
     )
 
 # Основной контент
@@ -165,6 +340,14 @@ else:
             help="Загрузите файл методики в формате PDF"
         )
         
+        current_handler = st.session_state.methodology_handler
+        append_to_current = st.checkbox(
+            "Добавить к текущей методике",
+            value=True,
+            disabled=current_handler is None,
+            help="Новая методика дополнит уже загруженный индекс, embeddings считаются только для неё"
+        )
+        
         if uploaded_file is not None:
             if st.button("Обработать методику"):
                 with st.spinner("Обработка методики..."):
@@ -172,25 +355,47 @@ else:
                         # Создаем директории
                         create_directories()
                         
-                        # Сохраняем загруженный файл
-                        file_path = f"storage/methodologies/{uploaded_file.name}"
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        
-                        # Извлекаем текст
-                        methodology_text = extract_text_from_pdf(file_path)
-                        
-                        # Инициализируем обработчик методики
-                        methodology_handler = MethodologyHandler(api_key=api_key)
-                        chunks = methodology_handler.process_methodology(methodology_text)
+                        # Индекс хранится по хэшу содержимого: повторная загрузка того же
+                        # набора методик не требует ни разбора PDF, ни запросов к API
+                        pdf_bytes = uploaded_file.getbuffer()
+                        source_id = hashlib.sha256(pdf_bytes).hexdigest()
+                        base_handler = current_handler if append_to_current else None
+                        base_sources = base_handler.sources if base_handler else []
+                        index_dir = INDEX_ROOT / corpus_key(base_sources + [source_id])
                         
-                        # Сохраняем индекс
-                        methodology_handler.save_index("storage/methodologies/index")
-                        
-                        # Сохраняем в состояние сессии
-                        st.session_state.methodology_handler = methodology_handler
-                        
-                        st.success(f"Методика успешно обработана! Создано {chunks} фрагментов.")
+                        if source_id in base_sources:
+                            st.info("Эта методика уже входит в текущий индекс.")
+                        elif index_dir.exists():
+                            # Отмечаем индекс как последний использованный
+                            os.utime(index_dir)
+                            st.session_state.methodology_handler = get_methodology_handler(api_key, str(index_dir))
+                            st.success("Методика уже была обработана ранее, индекс загружен из хранилища.")
+                        else:
+                            # Сохраняем загруженный файл
+                            file_path = f"storage/methodologies/{uploaded_file.name}"
+                            with open(file_path, "wb") as f:
+                                f.write(pdf_bytes)
+                            
+                            # Текущий индекс открываем для записи отдельной копией, чтобы не
+                            # менять обработчик, общий для сессий через st.cache_resource
+                            methodology_handler = MethodologyHandler(api_key=api_key)
+                            if base_handler and base_handler.index_path:
+                                methodology_handler.load_index(base_handler.index_path, mmap=False)
+                            
+                            # Строим индекс: извлечение страниц, разбиение на фрагменты и
+                            # запросы embeddings выполняются конвейером
+                            chunks = methodology_handler.process_methodology_pdf(file_path, source_id)
+                            
+                            # Сохраняем индекс во временный каталог и переименовываем,
+                            # чтобы прерванное сохранение не оставило неполный индекс
+                            tmp_dir = index_dir.with_name(index_dir.name + ".tmp")
+                            methodology_handler.save_index(str(tmp_dir))
+                            tmp_dir.replace(index_dir)
+                            
+                            # Сохраняем в состояние сессии
+                            st.session_state.methodology_handler = get_methodology_handler(api_key, str(index_dir))
+                            
+                            st.success(f"Методика успешно обработана! Создано {chunks} фрагментов.")
                     
                     except Exception as e:
                         st.error(f"Ошибка при обработке методики: {str(e)}")
@@ -215,22 +420,26 @@ else:
             else:
                 with st.spinner("Анализ дела и формирование плана..."):
                     try:
-                        # Извлекаем факты
-                        facts = extract_facts(st.session_state.openai_client, case_description)
+                        # Извлекаем факты, выводя ответ по мере генерации
+                        st.subheader("📝 Извлечённые факты")
+                        facts_ph = st.empty()
+                        facts = run_async(extract_facts(
+                            st.session_state.openai_client,
+                            case_description,
+                            facts_ph
+                        ))
+                        facts_ph.markdown(facts)
                         
                         # Формируем план
-                        plan = create_investigation_plan(
+                        st.subheader("📌 План расследования")
+                        plan_ph = st.empty()
+                        plan = run_async(create_investigation_plan(
                             st.session_state.openai_client,
                             facts,
-                            st.session_state.methodology_handler
-                        )
-                        
-                        # Показываем результаты
-                        st.subheader("📝 Извлечённые факты")
-                        st.markdown(facts)
-                        
-                        st.subheader("📌 План расследования")
-                        st.markdown(plan)
+                            st.session_state.methodology_handler,
+                            plan_ph
+                        ))
+                        plan_ph.markdown(plan)
                         
                         # Создаем результаты для сохранения
                         results = {
@@ -240,23 +449,90 @@ else:
                             "generated_at": datetime.now().isoformat()
                         }
                         
+                        # Сериализуем один раз: те же байты пишем на диск и отдаём на скачивание
+                        data = orjson.dumps(results, option=orjson.OPT_INDENT_2)
+                        
                         # Сохраняем результаты
+                        create_directories()
                         results_path = f"storage/results/plan_{case_number}.json"
-                        with open(results_path, "w", encoding="utf-8") as f:
-                            json.dump(results, f, ensure_ascii=False, indent=2)
+                        Path(results_path).write_bytes(data)
                         
                         # Кнопка для скачивания
-                        with open(results_path, "r", encoding="utf-8") as f:
-                            st.download_button(
-                                label="💾 Скачать результаты",
-                                data=f.read(),
-                                file_name=f"plan_{case_number}.json",
-                                mime="application/json"
-                            )
+                        st.download_button(
+                            label="💾 Скачать результаты",
+                            data=data,
+                            file_name=f"plan_{case_number}.json",
+                            mime="application/json"
+                        )
                     
                     except Exception as e:
                         st.error(f"Ошибка при формировании плана: {str(e)}")
 
+    elif page == "Пакетная обработка":
+        st.header("🗂️ Пакетная обработка дел")
+        st.info("Дела обрабатываются через OpenAI Batch API в течение 24 часов по сниженной стоимости")
+        
+        batch_client = get_openai_client(api_key)
+        
+        cases_file = st.file_uploader(
+            "Выберите CSV файл с делами",
+            type=["csv"],
+            help="Файл должен содержать колонки case_number и case_description"
+        )
+        
+        if cases_file is not None:
+            if st.button("Отправить на пакетную обработку"):
+                with st.spinner("Отправка дел..."):
+                    try:
+                        create_directories()
+                        cases = read_cases_csv(cases_file.getvalue())
+                        st.session_state.batch_id = submit_batch(
+                            batch_client,
+                            cases,
+                            st.session_state.methodology_handler
+                        )
+                        st.success(f"Отправлено дел: {len(cases)}. Идентификатор задания: {st.session_state.batch_id}")
+                    except Exception as e:
+                        st.error(f"Ошибка при отправке пакета: {str(e)}")
+        
+        if st.session_state.batch_id:
+            st.subheader("⏳ Статус задания")
+            st.write(f"Идентификатор задания: `{st.session_state.batch_id}`")
+            
+            if st.button("Проверить статус"):
+                try:
+                    batch = batch_client.batches.retrieve(st.session_state.batch_id)
+                    counts = batch.request_counts
+                    st.write(f"Статус: **{batch.status}**")
+                    if counts:
+                        st.write(f"Выполнено: {counts.completed} из {counts.total}, с ошибкой: {counts.failed}")
+                    
+                    if batch.status == "completed":
+                        plans = fetch_batch_results(batch_client, batch)
+                        for case_number, plan in plans.items():
+                            with st.expander(f"Дело № {case_number}"):
+                                st.markdown(plan)
+                        
+                        results = {
+                            "batch_id": batch.id,
+                            "plans": plans,
+                            "generated_at": datetime.now().isoformat()
+                        }
+                        data = orjson.dumps(results, option=orjson.OPT_INDENT_2)
+                        create_directories()
+                        Path(f"storage/results/batch_{batch.id}.json").write_bytes(data)
+                        
+                        st.download_button(
+                            label="💾 Скачать результаты",
+                            data=data,
+                            file_name=f"batch_{batch.id}.json",
+                            mime="application/json"
+                        )
+                    elif batch.status in TERMINAL_STATUSES:
+                        st.error(f"Пакетное задание завершилось со статусом: {batch.status}")
+                except Exception as e:
+                    st.error(f"Ошибка при получении результатов пакета: {str(e)}")
+
 # Нижний колонтитул
 st.markdown("---")
 st.markdown(
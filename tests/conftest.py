@@ -0,0 +1,45 @@
+# tests/conftest.py
+
+import asyncio
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_classic.embeddings import CacheBackedEmbeddings
+from langchain_classic.storage import LocalFileStore
+from utils.methodology_handler import MethodologyHandler
+
+EMBEDDING_SIZE = 32
+
+def process_pages(handler, pages, source_id=None) -> int:
+    """Прогоняет готовые страницы через конвейер aprocess_pages"""
+    async def aiter_pages():
+        for page in pages:
+            yield page
+
+    return asyncio.run(handler.aprocess_pages(aiter_pages(), source_id))
+
+@pytest.fixture
+def make_handler(tmp_path, monkeypatch):
+    """
+    Фабрика обработчиков методики без обращений к сети: разделитель считает
+    символы (словарь tiktoken скачивается из интернета), embeddings детерминированные.
+    Все обработчики теста используют общий кэш embeddings.
+    """
+    monkeypatch.setattr(
+        RecursiveCharacterTextSplitter,
+        "from_tiktoken_encoder",
+        classmethod(lambda cls, encoding_name=None, **kwargs: cls(**kwargs))
+    )
+    cache_dir = tmp_path / "emb_cache"
+
+    def make():
+        handler = MethodologyHandler(api_key="sk-test", cache_dir=str(cache_dir))
+        handler.embeddings = CacheBackedEmbeddings.from_bytes_store(
+            DeterministicFakeEmbedding(size=EMBEDDING_SIZE),
+            LocalFileStore(str(cache_dir)),
+            namespace="test",
+            key_encoder="sha256"
+        )
+        return handler
+
+    return make
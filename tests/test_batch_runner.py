@@ -0,0 +1,88 @@
+# tests/test_batch_runner.py
+
+import json
+import types
+import pytest
+from utils.batch_runner import BatchError, build_batch_requests, fetch_batch_results, read_cases_csv
+
+def success_line(custom_id: str, content: str) -> str:
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}},
+        "error": None
+    })
+
+def failure_line(custom_id: str, status_code: int = 400, message: str = "bad request") -> str:
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": {"status_code": status_code, "body": {"error": {"message": message}}},
+        "error": None
+    })
+
+def expired_line(custom_id: str) -> str:
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": None,
+        "error": {"code": "batch_expired", "message": "expired"}
+    })
+
+def fake_client(files):
+    """Клиент, отдающий заранее заданное содержимое файлов по идентификатору"""
+    content = lambda file_id: types.SimpleNamespace(text=files[file_id])
+    return types.SimpleNamespace(files=types.SimpleNamespace(content=content))
+
+def make_batch(output_file_id=None, error_file_id=None):
+    return types.SimpleNamespace(id="batch_1", output_file_id=output_file_id, error_file_id=error_file_id)
+
+def test_results_merge_output_and_error_files():
+    client = fake_client({
+        "out": success_line("1", "  план 1  ") + "\n\n",
+        "err": failure_line("2") + "\n" + expired_line("3") + "\n",
+    })
+    results = fetch_batch_results(client, make_batch("out", "err"))
+
+    assert results["1"] == "план 1"
+    assert results["2"].startswith("Ошибка при создании плана") and "bad request" in results["2"]
+    assert "batch_expired" in results["3"]
+
+def test_all_requests_failed():
+    client = fake_client({"err": failure_line("1", 500, "server error")})
+    results = fetch_batch_results(client, make_batch(error_file_id="err"))
+    assert list(results) == ["1"]
+    assert "server error" in results["1"]
+
+def test_non_200_line_in_output_file():
+    client = fake_client({"out": failure_line("1", 429, "rate limit") + "\n" + success_line("2", "план")})
+    results = fetch_batch_results(client, make_batch("out"))
+    assert "rate limit" in results["1"]
+    assert results["2"] == "план"
+
+def test_success_wins_over_error_for_same_case():
+    client = fake_client({"out": success_line("1", "план"), "err": failure_line("1")})
+    assert fetch_batch_results(client, make_batch("out", "err")) == {"1": "план"}
+
+def test_no_result_files():
+    with pytest.raises(BatchError):
+        fetch_batch_results(fake_client({}), make_batch())
+
+def test_duplicate_case_numbers_rejected():
+    with pytest.raises(BatchError):
+        build_batch_requests([("1", "кража"), ("1", "грабёж")])
+
+def test_requests_use_case_number_as_custom_id():
+    requests = build_batch_requests([("1", "кража"), ("2", "грабёж")])
+    assert [r["custom_id"] for r in requests] == ["1", "2"]
+    assert requests[1]["body"]["messages"][1]["content"].startswith("Фабула: грабёж")
+
+def test_read_cases_csv():
+    data = "case_number,case_description\n 1 , кража \n,\n2,грабёж\n".encode("utf-8-sig")
+    assert read_cases_csv(data) == [("1", "кража"), ("2", "грабёж")]
+
+def test_read_cases_csv_short_row():
+    data = "case_number,case_description\n1,кража\n2\n".encode("utf-8")
+    with pytest.raises(BatchError, match="Строка 3"):
+        read_cases_csv(data)
+
+def test_read_cases_csv_missing_columns():
+    with pytest.raises(BatchError, match="case_description"):
+        read_cases_csv(b"case_number,text\n1,x\n")
@@ -0,0 +1,25 @@
+# tests/test_corpus_key.py
+
+import hashlib
+from utils.methodology_handler import corpus_key
+
+def sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def test_single_source_keeps_file_hash():
+    # Каталоги индексов одной методики, сохранённые до поддержки нескольких методик
+    source = sha(b"methodology")
+    assert corpus_key([source]) == source
+
+def test_order_independent():
+    a, b, c = sha(b"a"), sha(b"b"), sha(b"c")
+    assert corpus_key([a, b, c]) == corpus_key([c, a, b])
+
+def test_distinct_sets_give_distinct_keys():
+    a, b, c = sha(b"a"), sha(b"b"), sha(b"c")
+    keys = {corpus_key([a]), corpus_key([b]), corpus_key([a, b]), corpus_key([a, c]), corpus_key([a, b, c])}
+    assert len(keys) == 5
+
+def test_combined_key_differs_from_members():
+    a, b = sha(b"a"), sha(b"b")
+    assert corpus_key([a, b]) not in (a, b)
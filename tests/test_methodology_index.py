@@ -0,0 +1,129 @@
+# tests/test_methodology_index.py
+
+import json
+import pytest
+from utils.docstore import JsonlDocstore
+from tests.conftest import process_pages
+from utils.methodology_handler import DOCSTORE_FILE, DOCSTORE_IDS_FILE, SOURCES_FILE
+
+def make_pages(prefix: str, count: int):
+    """Страницы методики с уникальным текстом"""
+    return [f"{prefix} {i}. " + f"{prefix.lower()}{i} " * 60 for i in range(count)]
+
+def all_documents(handler):
+    """Документы хранилища в порядке позиций индекса"""
+    store = handler.vector_store
+    return [
+        store.docstore.search(store.index_to_docstore_id[i])
+        for i in range(store.index.ntotal)
+    ]
+
+def test_save_and_mmap_load(make_handler, tmp_path):
+    handler = make_handler()
+    chunks = process_pages(handler, make_pages("Альфа", 5), "a")
+    handler.save_index(str(tmp_path / "index"))
+
+    loaded = make_handler()
+    loaded.load_index(str(tmp_path / "index"))
+
+    assert isinstance(loaded.vector_store.docstore, JsonlDocstore)
+    assert loaded.vector_store.index.ntotal == chunks
+    assert loaded.sources == ["a"]
+    assert [(d.page_content, d.metadata) for d in all_documents(loaded)] == \
+        [(d.page_content, d.metadata) for d in all_documents(handler)]
+
+    query = "альфа2 альфа2"
+    assert [d.page_content for d in loaded.find_relevant_recommendations(query)] == \
+        [d.page_content for d in handler.find_relevant_recommendations(query)]
+
+def test_docstore_offsets_point_to_lines(make_handler, tmp_path):
+    handler = make_handler()
+    process_pages(handler, make_pages("Альфа", 3), "a")
+    handler.save_index(str(tmp_path / "index"))
+
+    with open(tmp_path / "index" / DOCSTORE_IDS_FILE, encoding="utf-8") as f:
+        entries = json.load(f)
+    with open(tmp_path / "index" / DOCSTORE_FILE, "rb") as f:
+        for doc_id, offset in entries:
+            f.seek(offset)
+            assert json.loads(f.readline())["id"] == doc_id
+
+def test_append_requires_writable_load(make_handler, tmp_path):
+    handler = make_handler()
+    chunks = process_pages(handler, make_pages("Альфа", 3), "a")
+    handler.save_index(str(tmp_path / "index"))
+
+    # Отображённый индекс не дополняется: FAISS не владеет его кодами
+    loaded = make_handler()
+    loaded.load_index(str(tmp_path / "index"))
+    with pytest.raises(ValueError, match="mmap=False"):
+        process_pages(loaded, make_pages("Бета", 2), "b")
+    assert loaded.vector_store.index.ntotal == chunks
+    assert loaded.sources == ["a"]
+
+    writable = make_handler()
+    writable.load_index(str(tmp_path / "index"), mmap=False)
+    added = process_pages(writable, make_pages("Бета", 2), "b")
+    assert writable.vector_store.index.ntotal == chunks + added
+
+def test_append_and_reload(make_handler, tmp_path):
+    first = make_handler()
+    first_chunks = process_pages(first, make_pages("Альфа", 4), "a")
+    first.save_index(str(tmp_path / "a"))
+
+    writable = make_handler()
+    writable.load_index(str(tmp_path / "a"), mmap=False)
+    second_chunks = process_pages(writable, make_pages("Бета", 3), "b")
+    writable.save_index(str(tmp_path / "ab"))
+
+    reloaded = make_handler()
+    reloaded.load_index(str(tmp_path / "ab"))
+    docs = all_documents(reloaded)
+
+    assert reloaded.vector_store.index.ntotal == first_chunks + second_chunks
+    assert reloaded.sources == ["a", "b"]
+    assert [d.metadata["chunk_id"] for d in docs] == list(range(len(docs)))
+    assert [d.metadata["source_id"] for d in docs] == ["a"] * first_chunks + ["b"] * second_chunks
+    assert all(d.page_content.startswith("Бета") for d in docs[first_chunks:])
+
+    # Исходный индекс при дополнении не меняется
+    with open(tmp_path / "a" / SOURCES_FILE, encoding="utf-8") as f:
+        assert json.load(f) == ["a"]
+
+def test_save_over_loaded_index(make_handler, tmp_path):
+    path = str(tmp_path / "index")
+    handler = make_handler()
+    process_pages(handler, make_pages("Альфа", 4), "a")
+    handler.save_index(path)
+
+    # Дополненный индекс сохраняется в тот же каталог, из которого читаются документы
+    writable = make_handler()
+    writable.load_index(path, mmap=False)
+    process_pages(writable, make_pages("Бета", 2), "b")
+    expected = [d.page_content for d in all_documents(writable)]
+    writable.save_index(path)
+
+    # После сохранения новые документы читаются из перезаписанного файла
+    assert not writable.vector_store.docstore._added
+    assert [d.page_content for d in all_documents(writable)] == expected
+
+    reloaded = make_handler()
+    reloaded.load_index(path)
+    assert [d.page_content for d in all_documents(reloaded)] == expected
+
+def test_jsonl_docstore_add_and_delete(make_handler, tmp_path):
+    handler = make_handler()
+    process_pages(handler, make_pages("Альфа", 2), "a")
+    handler.save_index(str(tmp_path / "index"))
+
+    loaded = make_handler()
+    loaded.load_index(str(tmp_path / "index"))
+    docstore = loaded.vector_store.docstore
+    doc_id = loaded.vector_store.index_to_docstore_id[0]
+
+    assert docstore.search("missing") == "ID missing not found."
+    with pytest.raises(ValueError):
+        docstore.add({doc_id: docstore.search(doc_id)})
+
+    docstore.delete([doc_id])
+    assert docstore.search(doc_id) == f"ID {doc_id} not found."
@@ -0,0 +1,37 @@
+# tests/test_mmr.py
+
+import numpy as np
+from utils.methodology_handler import _maximal_marginal_relevance
+
+def test_first_pick_is_most_relevant():
+    query = np.array([1.0, 0.0], dtype=np.float32)
+    candidates = np.array([[0.0, 1.0], [0.9, 0.1], [0.5, 0.5]], dtype=np.float32)
+    assert _maximal_marginal_relevance(query, candidates, 1) == [1]
+
+def test_duplicates_are_skipped_for_diversity():
+    query = np.array([1.0, 0.2], dtype=np.float32)
+    candidates = np.array([
+        [1.0, 0.0],
+        [1.0, 0.0],   # дубликат первого кандидата
+        [0.6, 0.8],
+    ], dtype=np.float32)
+    assert _maximal_marginal_relevance(query, candidates, 2) == [0, 2]
+
+def test_pure_relevance_ignores_redundancy():
+    query = np.array([1.0, 0.2], dtype=np.float32)
+    candidates = np.array([[1.0, 0.0], [1.0, 0.0], [0.6, 0.8]], dtype=np.float32)
+    assert _maximal_marginal_relevance(query, candidates, 2, lambda_mult=1.0) == [0, 1]
+
+def test_k_larger_than_candidates():
+    query = np.array([1.0, 0.0], dtype=np.float32)
+    candidates = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    assert sorted(_maximal_marginal_relevance(query, candidates, 5)) == [0, 1]
+
+def test_scale_invariant_and_zero_vectors():
+    query = np.array([10.0, 0.0], dtype=np.float32)
+    candidates = np.array([[0.0, 0.0], [3.0, 0.1], [0.0, 2.0]], dtype=np.float32)
+    assert _maximal_marginal_relevance(query, candidates, 1) == [1]
+
+def test_no_candidates():
+    query = np.array([1.0, 0.0], dtype=np.float32)
+    assert _maximal_marginal_relevance(query, np.empty((0, 2), dtype=np.float32), 3) == []
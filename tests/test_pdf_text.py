@@ -0,0 +1,33 @@
+# tests/test_pdf_text.py
+
+from utils.pdf_parser import MIN_PAGE_CHARS, _clean_pages, _normalize_page_text
+
+def test_spaces_and_tabs_collapse():
+    assert _normalize_page_text("Статья  1.\t\tОбщие   положения") == "Статья 1. Общие положения"
+
+def test_spaces_around_line_breaks_trimmed():
+    assert _normalize_page_text("первая строка  \n   вторая\t\n\tтретья") == "первая строка\nвторая\nтретья"
+
+def test_blank_lines_collapse_to_paragraph_break():
+    assert _normalize_page_text("абзац 1\n\n\n\n  \n\nабзац 2") == "абзац 1\n\nабзац 2"
+    # Одиночный разрыв абзаца сохраняется для разделителя фрагментов
+    assert _normalize_page_text("абзац 1\n\nабзац 2") == "абзац 1\n\nабзац 2"
+
+def test_outer_whitespace_stripped():
+    assert _normalize_page_text("\n\n  текст  \n\n") == "текст"
+
+def test_clean_pages_drops_short_empty_and_failed_pages():
+    long_page = "Методические рекомендации " * 5
+    short_page = "1"
+    pages = [long_page, short_page, "   \n\n  ", None, long_page + "\n\n\n\nконец"]
+
+    cleaned = _clean_pages(pages, 1)
+
+    assert cleaned == [_normalize_page_text(long_page), _normalize_page_text(long_page + "\n\n\n\nконец")]
+
+def test_min_page_chars_boundary():
+    assert _clean_pages(["я" * MIN_PAGE_CHARS], 1) == ["я" * MIN_PAGE_CHARS]
+    assert _clean_pages(["я" * (MIN_PAGE_CHARS - 1)], 1) == []
+    # Порог применяется после нормализации пробелов
+    padded = "я" * 20 + " " * MIN_PAGE_CHARS + "я" * 20
+    assert _clean_pages([padded], 1) == []
@@ -0,0 +1,55 @@
+# tests/test_pipeline.py
+
+import asyncio
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+class SlowEmbeddings(DeterministicFakeEmbedding):
+    """Embeddings с задержкой ответа, считающие одновременные запросы"""
+    in_flight: int = 0
+    max_in_flight: int = 0
+    calls: int = 0
+    fail_on_call: int = 0
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        call = self.calls
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if call == self.fail_on_call:
+                raise RuntimeError("429 Too Many Requests")
+            return self.embed_documents(texts)
+        finally:
+            self.in_flight -= 1
+
+async def aiter_pages(count: int, produced: list):
+    for i in range(count):
+        produced.append(i)
+        await asyncio.sleep(0)
+        yield f"Страница {i}. " + f"слово{i} " * 60
+
+def test_embedding_requests_are_bounded(make_handler, monkeypatch):
+    handler = make_handler()
+    handler.embeddings = SlowEmbeddings(size=16)
+    monkeypatch.setattr(handler, "PIPELINE_BATCH_SIZE", 2)
+
+    chunks = asyncio.run(handler.aprocess_pages(aiter_pages(60, []), "a"))
+
+    assert handler.embeddings.calls > handler.PIPELINE_MAX_CONCURRENCY
+    assert handler.embeddings.max_in_flight == handler.PIPELINE_MAX_CONCURRENCY
+    assert handler.vector_store.index.ntotal == chunks
+
+def test_embedding_failure_stops_pipeline_early(make_handler, monkeypatch):
+    handler = make_handler()
+    handler.embeddings = SlowEmbeddings(size=16, fail_on_call=1)
+    monkeypatch.setattr(handler, "PIPELINE_BATCH_SIZE", 2)
+    produced = []
+
+    with pytest.raises(RuntimeError, match="429"):
+        asyncio.run(handler.aprocess_pages(aiter_pages(200, produced), "a"))
+
+    # Разбор прекращается вскоре после ошибки, а не доходит до конца документа
+    assert len(produced) < 200
+    assert handler.vector_store is None
@@ -0,0 +1,25 @@
+# tests/test_search_cache.py
+
+from tests.conftest import process_pages
+
+def test_search_cache_evicts_least_recently_used(make_handler, monkeypatch):
+    handler = make_handler()
+    process_pages(handler, ["Методика. " + "слово " * 200], "a")
+    monkeypatch.setattr(handler, "SEARCH_CACHE_SIZE", 2)
+
+    embedded = []
+    underlying = handler.embeddings.underlying_embeddings
+    original = type(underlying).embed_documents
+    monkeypatch.setattr(
+        type(underlying), "embed_documents",
+        lambda self, texts: embedded.extend(texts) or original(self, texts)
+    )
+
+    handler.find_relevant_recommendations("a")
+    handler.find_relevant_recommendations("b")
+    handler.find_relevant_recommendations("a")  # попадание делает "a" недавно использованным
+    handler.find_relevant_recommendations("c")  # вытесняет "b", а не "a"
+    handler.find_relevant_recommendations("a")
+    handler.find_relevant_recommendations("b")
+
+    assert embedded == ["a", "b", "c", "b"]
@@ -0,0 +1,169 @@
+# utils/batch_runner.py
+
+import io
+import csv
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Tuple, Any
+from utils.prompts import SYS_PLANNER, build_batch_plan_prompt
+
+logger = logging.getLogger(__name__)
+
+# Конечные статусы пакетного задания OpenAI
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+class BatchError(Exception):
+    """Исключение для ошибок пакетной обработки"""
+    pass
+
+def read_cases_csv(data: bytes) -> List[Tuple[str, str]]:
+    """
+    Читает список дел из CSV (колонки case_number и case_description).
+    Строки без номера дела пропускаются.
+
+    Args:
+        data (bytes): содержимое CSV файла в UTF-8
+
+    Returns:
+        List[Tuple[str, str]]: пары (номер дела, описание фабулы)
+
+    Raises:
+        BatchError: Если нет нужных колонок или у дела пустое описание
+    """
+    reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+    missing = {"case_number", "case_description"} - set(reader.fieldnames or [])
+    if missing:
+        raise BatchError(f"В CSV отсутствуют колонки: {', '.join(sorted(missing))}")
+
+    cases = []
+    for row in reader:
+        # В коротких строках CSV отсутствующие колонки равны None
+        case_number = (row["case_number"] or "").strip()
+        if not case_number:
+            continue
+        case_description = (row["case_description"] or "").strip()
+        if not case_description:
+            raise BatchError(f"Строка {reader.line_num}: пустое описание дела {case_number}")
+        cases.append((case_number, case_description))
+    return cases
+
+def build_batch_requests(cases: List[Tuple[str, str]], methodology_handler=None) -> List[Dict[str, Any]]:
+    """
+    Формирует строки запросов для Batch API.
+
+    Args:
+        cases (List[Tuple[str, str]]): пары (номер дела, описание фабулы)
+        methodology_handler: обработчик методики для добавления рекомендаций (необязательно)
+
+    Returns:
+        List[Dict[str, Any]]: запросы в формате Batch API
+
+    Raises:
+        BatchError: Если номера дел повторяются или описание пустое
+    """
+    seen = set()
+    for case_number, case_description in cases:
+        if case_number in seen:
+            raise BatchError(f"Номер дела повторяется: {case_number}")
+        if not case_description or not case_description.strip():
+            raise BatchError(f"Пустое описание дела: {case_number}")
+        seen.add(case_number)
+
+    # Контекст методики для всех дел одним запросом embeddings
+    contexts = [""] * len(cases)
+    if methodology_handler:
+        contexts = methodology_handler.get_recommendations_contexts(
+            [case_description for _, case_description in cases]
+        )
+
+    requests = []
+    for (case_number, case_description), methodology_context in zip(cases, contexts):
+        requests.append({
+            "custom_id": case_number,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": "gpt-4o-mini",
+                "messages": [
+                    {"role": "system", "content": SYS_PLANNER},
+                    {"role": "user", "content": build_batch_plan_prompt(case_description, methodology_context)}
+                ],
+                "max_tokens": 900,
+                "temperature": 0.5
+            }
+        })
+    return requests
+
+def submit_batch(client, cases: List[Tuple[str, str]], methodology_handler=None,
+                 files_dir: str = "storage/files") -> str:
+    """
+    Отправляет дела на пакетную обработку через OpenAI Batch API.
+
+    Args:
+        client: синхронный клиент OpenAI
+        cases (List[Tuple[str, str]]): пары (номер дела, описание фабулы)
+        methodology_handler: обработчик методики (необязательно)
+        files_dir (str): каталог для сохранения входного JSONL файла
+
+    Returns:
+        str: идентификатор пакетного задания
+    """
+    if not cases:
+        raise BatchError("Список дел пуст")
+
+    requests = build_batch_requests(cases, methodology_handler)
+
+    # Сохраняем входной файл, чтобы задание можно было воспроизвести
+    Path(files_dir).mkdir(parents=True, exist_ok=True)
+    input_path = Path(files_dir) / f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    with open(input_path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h"
+    )
+    logger.info("Пакетное задание %s создано, дел: %d", batch.id, len(requests))
+    return batch.id
+
+def fetch_batch_results(client, batch) -> Dict[str, str]:
+    """
+    Загружает и разбирает результаты завершённого пакетного задания.
+
+    Args:
+        client: синхронный клиент OpenAI
+        batch: завершённое пакетное задание
+
+    Returns:
+        Dict[str, str]: план расследования (или текст ошибки) по номеру дела
+    """
+    # Успешные ответы пишутся в файл результатов, неудачные запросы - в файл
+    # ошибок. Если все запросы завершились ошибкой, файла результатов нет.
+    # Файл ошибок читается первым, чтобы успешный ответ по делу имел приоритет
+    file_ids = [file_id for file_id in (batch.error_file_id, batch.output_file_id) if file_id]
+    if not file_ids:
+        raise BatchError(f"У задания {batch.id} нет файлов результатов")
+
+    results = {}
+    for file_id in file_ids:
+        content = client.files.content(file_id).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or (response.get("body") or {}).get("error")
+                results[item["custom_id"]] = f"Ошибка при создании плана: {error}"
+                continue
+            results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+    return results
@@ -0,0 +1,77 @@
+# utils/docstore.py
+
+import json
+import os
+from typing import Dict, List, Union
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+class JsonlDocstore(Docstore, AddableMixin):
+    """
+    Хранилище документов в JSONL файле без pickle.
+    Документы читаются с диска по смещению строки только при обращении,
+    поэтому загрузка индекса не требует чтения всех текстов в память.
+    """
+
+    def __init__(self, path: str, offsets: Dict[str, int]):
+        """
+        Args:
+            path (str): путь к JSONL файлу с документами
+            offsets (Dict[str, int]): смещение строки в файле по идентификатору документа
+        """
+        self.path = path
+        self._offsets = offsets
+        # Документы, добавленные после загрузки и ещё не сохранённые на диск
+        self._added: Dict[str, Document] = {}
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Поиск документа по идентификатору"""
+        if search in self._added:
+            return self._added[search]
+        offset = self._offsets.get(search)
+        if offset is None:
+            return f"ID {search} not found."
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            item = json.loads(f.readline())
+        return Document(page_content=item["text"], metadata=item["metadata"])
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Добавление документов в память до следующего сохранения"""
+        overlapping = set(texts).intersection(self._offsets.keys() | self._added.keys())
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+
+    def delete(self, ids: List) -> None:
+        """Удаление документов по идентификаторам"""
+        for doc_id in ids:
+            self._offsets.pop(doc_id, None)
+            self._added.pop(doc_id, None)
+
+def write_jsonl_docstore(path: str, ids: List[str], docstore: Docstore) -> Dict[str, int]:
+    """
+    Запись документов в JSONL файл в порядке ids.
+    Файл сначала пишется во временный и затем атомарно заменяет существующий.
+    Args:
+        path (str): путь к JSONL файлу
+        ids (List[str]): идентификаторы документов в порядке позиций в индексе
+        docstore (Docstore): исходное хранилище документов
+    Returns:
+        Dict[str, int]: смещение строки в файле по идентификатору документа
+    """
+    offsets = {}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for doc_id in ids:
+            doc = docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Документ {doc_id} не найден в хранилище")
+            offsets[doc_id] = f.tell()
+            line = json.dumps(
+                {"id": doc_id, "text": doc.page_content, "metadata": doc.metadata},
+                ensure_ascii=False
+            )
+            f.write(line.encode("utf-8") + b"\n")
+    os.replace(tmp_path, path)
+    return offsets
@@ -1,32 +1,134 @@
 # utils/methodology_handler.py
 
-from typing import List
+from typing import List, Dict, Tuple, AsyncIterator, Optional
+from collections import OrderedDict
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_core.documents import Document
+from langchain_classic.embeddings import CacheBackedEmbeddings
+from langchain_classic.storage import LocalFileStore
+from utils.docstore import JsonlDocstore, write_jsonl_docstore
+from utils.pdf_parser import aiter_pdf_pages
+import numpy as np
+import faiss
+import asyncio
+import hashlib
+import json
+import uuid
+import time
 import os
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Токенизатор модели embeddings: размер фрагментов считается в его токенах
+TOKEN_ENCODING = "cl100k_base"
+
+# Файлы сохранённого индекса
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.jsonl"
+DOCSTORE_IDS_FILE = "docstore_ids.json"
+SOURCES_FILE = "sources.json"
+
+def corpus_key(sources: List[str]) -> str:
+    """
+    Ключ каталога индекса для набора методик.
+    Для одной методики это SHA256 её PDF, для нескольких - хэш их хэшей.
+    Args:
+        sources (List[str]): SHA256 содержимого PDF вошедших в индекс методик
+    Returns:
+        str: имя каталога индекса
+    """
+    if len(sources) == 1:
+        return sources[0]
+    return hashlib.sha256("\n".join(sorted(sources)).encode("utf-8")).hexdigest()
+
+def _maximal_marginal_relevance(query: np.ndarray, candidates: np.ndarray,
+                                k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Отбор k кандидатов по MMR (релевантность запросу минус сходство с уже отобранными).
+    Все косинусные сходства считаются заранее двумя матричными умножениями.
+    Args:
+        query (np.ndarray): вектор запроса, форма (d,)
+        candidates (np.ndarray): векторы кандидатов, форма (n, d)
+        k (int): количество отбираемых кандидатов
+        lambda_mult (float): баланс релевантности и разнообразия
+    Returns:
+        List[int]: индексы отобранных кандидатов в порядке отбора
+    """
+    if len(candidates) == 0:
+        return []
+    query = query / (np.linalg.norm(query) or 1.0)
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    candidates = candidates / np.where(norms == 0, 1.0, norms)
+
+    query_sims = candidates @ query
+    pair_sims = candidates @ candidates.T
+
+    selected = [int(np.argmax(query_sims))]
+    while len(selected) < min(k, len(candidates)):
+        redundancy = pair_sims[:, selected].max(axis=1)
+        scores = lambda_mult * query_sims - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
 class MethodologyHandler:
-    def __init__(self, api_key: str):
+    # Параметры кэша результатов поиска
+    SEARCH_CACHE_SIZE = 256
+    SEARCH_CACHE_TTL = 600  # секунд
+    # Количество фрагментов в одном запросе к API embeddings
+    EMBEDDING_BATCH_SIZE = 512
+    # Размер пакета фрагментов и очереди в конвейере обработки PDF: пакеты
+    # меньше, чтобы embeddings начинали запрашиваться до конца разбора документа
+    PIPELINE_BATCH_SIZE = 64
+    PIPELINE_QUEUE_SIZE = 8
+    # Не более стольких запросов embeddings конвейера одновременно (лимиты API)
+    PIPELINE_MAX_CONCURRENCY = 4
+    # Параметры HNSW графа
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 80
+    HNSW_EF_SEARCH = 64
+
+    def __init__(self, api_key: str, cache_dir: str = "storage/emb_cache"):
         """
         Инициализация обработчика методики.
         Args:
             api_key (str): API ключ для OpenAI
+            cache_dir (str): каталог для кэша embeddings фрагментов
         """
         os.environ["openai_api_key"] = api_key
         # Инициализируем embeddings с моделью text-embedding-3-small
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",
+        base_embeddings = OpenAIEmbeddings(
+            model=EMBEDDING_MODEL,
             openai_api_key=api_key
         )
+        # Кэшируем embeddings фрагментов по хэшу текста, чтобы повторная
+        # загрузка той же методики не требовала обращений к API
+        self.embeddings = CacheBackedEmbeddings.from_bytes_store(
+            base_embeddings,
+            LocalFileStore(cache_dir),
+            namespace=EMBEDDING_MODEL,
+            key_encoder="sha256"
+        )
         self.vector_store = None
+        # Идентификаторы (SHA256 PDF) методик, вошедших в индекс
+        self.sources: List[str] = []
+        # Каталог, из которого загружен индекс
+        self.index_path: Optional[str] = None
+        # Индекс отображён в память только для чтения и не может дополняться
+        self._read_only = False
+        # Кэш поиска: (sha256 запроса, top_k) -> (время, документы)
+        # в порядке последнего обращения (LRU)
+        self._search_cache: Dict[Tuple[str, int], Tuple[float, List[Document]]] = OrderedDict()
         
-        # Создаем разделитель текста
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+        # Создаем разделитель текста. Длина считается в токенах, а не в символах:
+        # кириллица занимает ~2 символа на токен, и фрагменты по 1000 символов
+        # получались вдвое меньше задуманного
+        self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=TOKEN_ENCODING,
+            chunk_size=512,
+            chunk_overlap=64,
             separators=[
                 "\n\n",  # Сначала разделяем по двойным переносам строк (параграфы)
                 "\n",    # Затем по одинарным переносам
@@ -37,35 +139,210 @@ class MethodologyHandler:
             ]
         )
 
-    def process_methodology(self, methodology_text: str) -> int:
+    def process_methodology(self, methodology_text: str, source_id: Optional[str] = None) -> int:
         """
         Обработка текста методики: разбиение на смысловые части и создание векторного индекса.
+        Если индекс уже есть, фрагменты добавляются к нему.
         Args:
             methodology_text (str): полный текст методики
+            source_id (Optional[str]): идентификатор методики (SHA256 PDF)
         Returns:
             int: количество созданных документов
         """
         try:
-            # Создаём документы из текста методики
-            documents = self.text_splitter.create_documents([methodology_text])
-            
-            # Добавляем метаданные к каждому документу
-            for i, doc in enumerate(documents):
-                doc.metadata = {
-                    "chunk_id": i,
-                    "source": "methodology",
-                    "chunk_size": len(doc.page_content)
-                }
-            
-            # Создаём векторное хранилище
-            self.vector_store = FAISS.from_documents(documents, self.embeddings)
+            # Разбиваем текст методики на фрагменты
+            texts = self.text_splitter.split_text(methodology_text)
             
-            return len(documents)
+            # Получаем embeddings пакетами и строим хранилище из готовых векторов
+            vectors = asyncio.run(self._aembed_texts(texts))
+            return self._index_chunks(texts, vectors, source_id)
             
         except Exception as e:
             print(f"Ошибка при обработке методики: {str(e)}")
             raise
 
+    def process_methodology_pdf(self, pdf_path: str, source_id: Optional[str] = None) -> int:
+        """
+        Обработка PDF методики конвейером: страницы разбиваются на фрагменты
+        по мере извлечения, и embeddings запрашиваются, не дожидаясь конца разбора PDF.
+        Args:
+            pdf_path (str): путь к PDF файлу методики
+            source_id (Optional[str]): идентификатор методики (SHA256 PDF)
+        Returns:
+            int: количество созданных документов
+        """
+        try:
+            return asyncio.run(self.aprocess_pages(aiter_pdf_pages(pdf_path), source_id))
+        except Exception as e:
+            print(f"Ошибка при обработке методики: {str(e)}")
+            raise
+
+    async def aprocess_pages(self, pages: AsyncIterator[str], source_id: Optional[str] = None) -> int:
+        """
+        Конвейер обработки страниц: производитель разбивает страницы на фрагменты
+        и передаёт их пакетами через очередь, потребитель отправляет пакеты на
+        получение embeddings, не более PIPELINE_MAX_CONCURRENCY запросов одновременно.
+        Args:
+            pages (AsyncIterator[str]): текст страниц в порядке документа
+            source_id (Optional[str]): идентификатор методики (SHA256 PDF)
+        Returns:
+            int: количество созданных документов
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.PIPELINE_QUEUE_SIZE)
+        semaphore = asyncio.Semaphore(self.PIPELINE_MAX_CONCURRENCY)
+        texts: List[str] = []
+        vectors: List[List[float]] = []
+        requests: List[asyncio.Task] = []
+        errors: List[BaseException] = []
+
+        async def producer():
+            batch = []
+            async for page in pages:
+                for chunk in self.text_splitter.split_text(page):
+                    batch.append(chunk)
+                    if len(batch) >= self.PIPELINE_BATCH_SIZE:
+                        await queue.put(batch)
+                        batch = []
+            if batch:
+                await queue.put(batch)
+            # Сигнал потребителю о завершении
+            await queue.put(None)
+
+        async def embed(batch):
+            try:
+                return await self.embeddings.aembed_documents(batch)
+            finally:
+                semaphore.release()
+
+        def on_done(request):
+            if not request.cancelled() and request.exception():
+                errors.append(request.exception())
+
+        async def consumer():
+            while (batch := await queue.get()) is not None:
+                # Ждём свободный слот: пока заняты все слоты, пакеты копятся в очереди,
+                # и заполненная очередь останавливает производителя
+                await semaphore.acquire()
+                # Ошибку запроса поднимаем сразу, не дожидаясь конца разбора PDF
+                if errors:
+                    semaphore.release()
+                    raise errors[0]
+                texts.extend(batch)
+                request = asyncio.create_task(embed(batch))
+                request.add_done_callback(on_done)
+                requests.append(request)
+            for request in requests:
+                vectors.extend(await request)
+
+        tasks = [asyncio.ensure_future(producer()), asyncio.ensure_future(consumer())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # При ошибке одной из сторон конвейера останавливаем другую и начатые запросы
+            for task in tasks + requests:
+                task.cancel()
+        if not texts:
+            raise ValueError("Методика не содержит текста для индексации")
+        return self._index_chunks(texts, vectors, source_id)
+
+    def _index_chunks(self, texts: List[str], vectors: List[List[float]],
+                      source_id: Optional[str] = None) -> int:
+        """
+        Создание векторного хранилища из фрагментов и их embeddings или
+        добавление фрагментов в уже существующее хранилище.
+        Args:
+            texts (List[str]): тексты фрагментов
+            vectors (List[List[float]]): embeddings фрагментов
+            source_id (Optional[str]): идентификатор методики (SHA256 PDF)
+        Returns:
+            int: количество созданных документов
+        """
+        # Коды векторов отображённого индекса не принадлежат FAISS: add() на нём
+        # завершает процесс по assert, а не бросает исключение
+        if self._read_only:
+            raise ValueError("Индекс загружен только для чтения. Загрузите его с mmap=False для дополнения")
+        
+        # Нумерация фрагментов продолжается после уже проиндексированных
+        offset = self.vector_store.index.ntotal if self.vector_store else 0
+        
+        # Добавляем метаданные к каждому документу
+        metadatas = [
+            {
+                "chunk_id": offset + i,
+                "source": "methodology",
+                "source_id": source_id,
+                "chunk_size": len(text)
+            }
+            for i, text in enumerate(texts)
+        ]
+        
+        if self.vector_store is None:
+            # Создаём векторное хранилище
+            self.vector_store = self._build_vector_store(texts, vectors, metadatas)
+        else:
+            # Добавляем к существующему: embeddings считаются только для новой методики
+            self.vector_store.add_embeddings(
+                list(zip(texts, vectors)),
+                metadatas=metadatas,
+                ids=[str(uuid.uuid4()) for _ in texts]
+            )
+        
+        if source_id and source_id not in self.sources:
+            self.sources.append(source_id)
+        self._search_cache.clear()
+        
+        return len(texts)
+
+    async def _aembed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Получение embeddings для списка текстов параллельными пакетными запросами.
+        Args:
+            texts (List[str]): тексты фрагментов
+        Returns:
+            List[List[float]]: векторы в порядке исходных текстов
+        """
+        batches = [
+            texts[i:i + self.EMBEDDING_BATCH_SIZE]
+            for i in range(0, len(texts), self.EMBEDDING_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(*[
+            self.embeddings.aembed_documents(batch) for batch in batches
+        ])
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def _build_vector_store(self, texts: List[str], vectors: List[List[float]],
+                            metadatas: List[dict]) -> FAISS:
+        """
+        Построение FAISS хранилища на HNSW индексе с векторами в float16.
+        Поиск по графу HNSW вместо полного перебора плоского индекса,
+        а хранение в float16 вдвое сокращает занимаемую векторами память.
+        Args:
+            texts (List[str]): тексты фрагментов
+            vectors (List[List[float]]): embeddings фрагментов
+            metadatas (List[dict]): метаданные фрагментов
+        Returns:
+            FAISS: векторное хранилище
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        index = faiss.IndexHNSWSQ(matrix.shape[1], faiss.ScalarQuantizer.QT_fp16, self.HNSW_M)
+        index.hnsw.efConstruction = self.HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = self.HNSW_EF_SEARCH
+        if not index.is_trained:
+            index.train(matrix)
+        index.add(matrix)
+
+        ids = [str(uuid.uuid4()) for _ in texts]
+        docstore = InMemoryDocstore({
+            doc_id: Document(page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        })
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=dict(enumerate(ids))
+        )
+
     def find_relevant_recommendations(self, query: str, top_k: int = 3) -> List[Document]:
         """
         Поиск релевантных рекомендаций из методики.
@@ -75,15 +352,71 @@ class MethodologyHandler:
         Returns:
             List[Document]: список релевантных документов методики
         """
+        return self.find_relevant_recommendations_batch([query], top_k)[0]
+
+    def find_relevant_recommendations_batch(self, queries: List[str], top_k: int = 3) -> List[List[Document]]:
+        """
+        Поиск релевантных рекомендаций для нескольких запросов.
+        Embeddings всех запросов, которых нет в кэше, получаются одним обращением к API.
+        Args:
+            queries (List[str]): тексты запросов
+            top_k (int): количество рекомендаций для каждого запроса
+        Returns:
+            List[List[Document]]: списки релевантных документов в порядке запросов
+        """
         if not self.vector_store:
             raise ValueError("Методика ещё не загружена. Сначала вызовите process_methodology()")
         
-        # Поиск релевантных фрагментов с MMR переранжированием для разнообразия
-        return self.vector_store.max_marginal_relevance_search(
-            query,
-            k=top_k,
-            fetch_k=top_k * 2  # Получаем больше кандидатов для лучшего разнообразия
-        )
+        # Повторные запросы с теми же фактами (перезапуски Streamlit) берём из кэша
+        keys = [(hashlib.sha256(query.encode("utf-8")).hexdigest(), top_k) for query in queries]
+        results: List[Optional[List[Document]]] = []
+        for key in keys:
+            cached = self._search_cache.get(key)
+            fresh = cached and time.monotonic() - cached[0] < self.SEARCH_CACHE_TTL
+            if fresh:
+                # Отмечаем запись как недавно использованную
+                self._search_cache.move_to_end(key)
+            results.append(cached[1] if fresh else None)
+        
+        misses = [i for i, docs in enumerate(results) if docs is None]
+        if misses:
+            # Запросы не кэшируются на диске (как и в embed_query), поэтому
+            # обращаемся к исходной модели в обход кэша фрагментов
+            vectors = self.embeddings.underlying_embeddings.embed_documents([queries[i] for i in misses])
+            for i, vector in zip(misses, vectors):
+                results[i] = self._search_by_vector(np.asarray(vector, dtype=np.float32), top_k)
+                
+                # Вытесняем давно не использованную запись при переполнении
+                self._search_cache.pop(keys[i], None)
+                if len(self._search_cache) >= self.SEARCH_CACHE_SIZE:
+                    self._search_cache.popitem(last=False)
+                self._search_cache[keys[i]] = (time.monotonic(), results[i])
+        return results
+
+    def _search_by_vector(self, query_vector: np.ndarray, top_k: int) -> List[Document]:
+        """
+        Поиск кандидатов по HNSW индексу и их MMR переранжирование.
+        Args:
+            query_vector (np.ndarray): вектор запроса, форма (d,)
+            top_k (int): количество рекомендаций для возврата
+        Returns:
+            List[Document]: список релевантных документов методики
+        """
+        # Получаем больше кандидатов для лучшего разнообразия
+        fetch_k = top_k * 2
+        _, positions = self.vector_store.index.search(query_vector.reshape(1, -1), fetch_k)
+        positions = positions[0][positions[0] != -1]
+        
+        # MMR переранжирование кандидатов для разнообразия. Восстанавливаем из
+        # индекса только векторы кандидатов, а не всю матрицу embeddings
+        candidates = self.vector_store.index.reconstruct_batch(positions)
+        selected = _maximal_marginal_relevance(query_vector, candidates, top_k)
+        return [
+            self.vector_store.docstore.search(
+                self.vector_store.index_to_docstore_id[int(positions[i])]
+            )
+            for i in selected
+        ]
 
     def get_recommendations_context(self, case_facts: str) -> str:
         """
@@ -93,32 +426,88 @@ class MethodologyHandler:
         Returns:
             str: отформатированный контекст с рекомендациями
         """
-        relevant_docs = self.find_relevant_recommendations(case_facts)
-        
-        # Форматируем рекомендации в единый текст
-        context = "На основе методических рекомендаций:\n\n"
-        for i, doc in enumerate(relevant_docs, 1):
-            # Добавляем информацию о части методики и её размере
-            context += f"{i}. [Часть {doc.metadata['chunk_id']}] {doc.page_content}\n\n"
+        return self.get_recommendations_contexts([case_facts])[0]
+
+    def get_recommendations_contexts(self, cases: List[str]) -> List[str]:
+        """
+        Формирование контекста рекомендаций для нескольких дел
+        с одним запросом embeddings на все дела.
+        Args:
+            cases (List[str]): факты или описания дел
+        Returns:
+            List[str]: отформатированные контексты в порядке дел
+        """
+        contexts = []
+        for relevant_docs in self.find_relevant_recommendations_batch(cases):
+            # Форматируем рекомендации в единый текст
+            context = "На основе методических рекомендаций:\n\n"
+            for i, doc in enumerate(relevant_docs, 1):
+                # Добавляем информацию о части методики и её размере
+                context += f"{i}. [Часть {doc.metadata['chunk_id']}] {doc.page_content}\n\n"
+            contexts.append(context)
         
-        return context
+        return contexts
 
     def save_index(self, path: str):
         """
-        Сохранение векторного индекса на диск.
+        Сохранение векторного индекса на диск без pickle: векторы в формате FAISS,
+        документы в JSONL и список идентификаторов со смещениями строк.
         Args:
             path (str): путь для сохранения
         """
         if self.vector_store:
-            self.vector_store.save_local(path)
+            os.makedirs(path, exist_ok=True)
+            index = self.vector_store.index
+            ids = [self.vector_store.index_to_docstore_id[i] for i in range(index.ntotal)]
+            
+            docstore_path = os.path.join(path, DOCSTORE_FILE)
+            offsets = write_jsonl_docstore(docstore_path, ids, self.vector_store.docstore)
+            with open(os.path.join(path, DOCSTORE_IDS_FILE), "w", encoding="utf-8") as f:
+                json.dump([[doc_id, offsets[doc_id]] for doc_id in ids], f)
+            faiss.write_index(index, os.path.join(path, INDEX_FILE))
+            with open(os.path.join(path, SOURCES_FILE), "w", encoding="utf-8") as f:
+                json.dump(self.sources, f)
+            
+            # Если документы читались из перезаписанного файла, обновляем смещения
+            docstore = self.vector_store.docstore
+            if isinstance(docstore, JsonlDocstore) and os.path.abspath(docstore.path) == os.path.abspath(docstore_path):
+                self.vector_store.docstore = JsonlDocstore(docstore_path, offsets)
 
-    def load_index(self, path: str):
+    def load_index(self, path: str, mmap: bool = True):
         """
         Загрузка векторного индекса с диска.
         Args:
             path (str): путь к сохранённому индексу
+            mmap (bool): отобразить коды векторов в память без копирования
+                (страницы подгружаются с диска по мере обращения);
+                такой индекс доступен только для чтения
         """
-        if os.path.exists(path):
-            self.vector_store = FAISS.load_local(path, self.embeddings)
+        index_path = os.path.join(path, INDEX_FILE)
+        docstore_path = os.path.join(path, DOCSTORE_FILE)
+        ids_path = os.path.join(path, DOCSTORE_IDS_FILE)
+        if not all(os.path.exists(p) for p in (index_path, docstore_path, ids_path)):
+            raise FileNotFoundError(f"Индекс не найден по пути: {path}")
+        
+        # IO_FLAG_MMAP для IndexHNSWSQ всё равно читает индекс в память целиком,
+        # отображение без копирования даёт только IO_FLAG_MMAP_IFC
+        flags = faiss.IO_FLAG_MMAP_IFC if mmap else 0
+        index = faiss.read_index(index_path, flags)
+        with open(ids_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        sources_path = os.path.join(path, SOURCES_FILE)
+        if os.path.exists(sources_path):
+            with open(sources_path, "r", encoding="utf-8") as f:
+                self.sources = json.load(f)
         else:
-            raise FileNotFoundError(f"Индекс не найден по пути: {path}")
\ No newline at end of file
+            self.sources = []
+        
+        # Тексты документов остаются на диске и читаются при обращении
+        self.vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=JsonlDocstore(docstore_path, {doc_id: offset for doc_id, offset in entries}),
+            index_to_docstore_id={i: doc_id for i, (doc_id, _) in enumerate(entries)}
+        )
+        self.index_path = path
+        self._read_only = mmap
+        self._search_cache.clear()
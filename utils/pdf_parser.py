@@ -1,99 +1,284 @@
 # utils/pdf_parser.py
 
-import PyPDF2
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 import os
+import re
+import asyncio
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Логирование настраивает приложение; здесь только логгер модуля
 logger = logging.getLogger(__name__)
 
+# Документы с таким числом страниц и меньше обрабатываются без пула процессов
+PARALLEL_MIN_PAGES = 4
+
+# PDFium не потокобезопасен даже для разных документов, а каждая сессия Streamlit
+# выполняется в своём потоке: все вызовы PDFium внутри процесса идут под блокировкой
+_PDFIUM_LOCK = threading.Lock()
+
+def _reset_pdfium_lock():
+    """Новая блокировка в процессе пула: унаследованная при fork могла быть захвачена"""
+    global _PDFIUM_LOCK
+    _PDFIUM_LOCK = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_pdfium_lock)
+
+# Страницы короче этого порога (колонтитулы, пустые листы) не попадают в текст
+MIN_PAGE_CHARS = 50
+
+_SPACES_RE = re.compile(r"[ \t]+")
+_LINE_EDGES_RE = re.compile(r" ?\n ?")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
 class PDFParsingError(Exception):
     """Исключение для ошибок парсинга PDF"""
     pass
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+def _is_encrypted(pdf: pdfium.PdfDocument) -> bool:
+    """Проверяет, защищён ли документ обработчиком безопасности"""
+    return pdfium_c.FPDF_GetSecurityHandlerRevision(pdf.raw) != -1
+
+def _extract_page_text(pdf: pdfium.PdfDocument, index: int) -> str:
+    """Извлекает текст одной страницы средствами PDFium"""
+    page = pdf[index]
+    try:
+        textpage = page.get_textpage()
+        try:
+            # PDFium разделяет строки через \r\n, а разделитель фрагментов ждёт \n
+            return textpage.get_text_range().replace("\r\n", "\n")
+        finally:
+            textpage.close()
+    finally:
+        page.close()
+
+def _normalize_page_text(text: str) -> str:
+    """Схлопывает повторяющиеся пробелы и пустые строки"""
+    text = _SPACES_RE.sub(" ", text)
+    text = _LINE_EDGES_RE.sub("\n", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[Optional[str]]:
     """
-    Извлекает текст из PDF файла.
+    Извлекает текст страниц [start, stop) в процессе пула или,
+    для небольших документов, в текущем процессе.
+    Для страниц, обработка которых завершилась ошибкой, возвращается None.
+    """
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            texts = []
+            total_pages = len(pdf)
+            for index in range(start, stop):
+                try:
+                    logger.debug("Обработка страницы %d/%d", index + 1, total_pages)
+                    texts.append(_extract_page_text(pdf, index))
+                except Exception as e:
+                    logger.error("Ошибка при обработке страницы %d: %s", index + 1, e)
+                    texts.append(None)
+            return texts
+        finally:
+            pdf.close()
+
+def _split_pages(total_pages: int, parts: int) -> List[Tuple[int, int]]:
+    """Делит страницы на непрерывные диапазоны примерно равного размера"""
+    size = -(-total_pages // parts)
+    return [(start, min(start + size, total_pages)) for start in range(0, total_pages, size)]
+
+def _open_pdf(pdf_path: str) -> int:
+    """
+    Проверяет файл и возвращает количество страниц.
+    
+    Raises:
+        PDFParsingError: Если файл не является PDF, повреждён или зашифрован
+        FileNotFoundError: Если файл не найден
+    """
+    # Проверяем существование файла
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"Файл не найден: {pdf_path}")
+    
+    # Проверяем расширение файла
+    if not pdf_path.lower().endswith('.pdf'):
+        raise PDFParsingError(f"Файл {pdf_path} не является PDF")
+    
+    logger.info("Начало обработки файла: %s", pdf_path)
+    
+    # Открываем PDF (PDFium извлекает текст в нативном коде)
+    with _PDFIUM_LOCK:
+        try:
+            pdf = pdfium.PdfDocument(pdf_path)
+        except pdfium.PdfiumError as e:
+            # Документ с паролем пользователя PDFium не открывает совсем
+            if e.err_code == pdfium_c.FPDF_ERR_PASSWORD:
+                raise PDFParsingError("PDF файл зашифрован")
+            raise PDFParsingError(f"Ошибка чтения PDF: {str(e)}")
+    
+        try:
+            # Проверяем, зашифрован ли файл
+            if _is_encrypted(pdf):
+                raise PDFParsingError("PDF файл зашифрован")
+        
+            total_pages = len(pdf)
+            logger.info("Найдено страниц: %d", total_pages)
+            return total_pages
+        finally:
+            pdf.close()
+
+def _page_ranges(total_pages: int) -> Tuple[List[Tuple[int, int]], bool]:
+    """
+    Страницы независимы, поэтому крупные документы делятся на диапазоны
+    для извлечения в пуле процессов в обход GIL.
+    Returns:
+        Tuple[List[Tuple[int, int]], bool]: диапазоны страниц и признак параллельной обработки
+    """
+    workers = min(os.cpu_count() or 1, total_pages)
+    if total_pages <= PARALLEL_MIN_PAGES or workers < 2:
+        return [(0, total_pages)], False
+    return _split_pages(total_pages, workers), True
+
+def _clean_pages(pages: List[Optional[str]], first_page_num: int) -> List[str]:
+    """Нормализует текст страниц и отбрасывает пустые и слишком короткие"""
+    text_content = []
+    for page_num, page_text in enumerate(pages, first_page_num):
+        # Ошибка страницы уже записана в журнал обработчиком диапазона
+        if page_text is None:
+            continue
+        
+        page_text = _normalize_page_text(page_text)
+        if not page_text:
+            logger.warning("Страница %d не содержит текста", page_num)
+            continue
+        
+        if len(page_text) < MIN_PAGE_CHARS:
+            logger.debug("Страница %d пропущена: слишком мало текста", page_num)
+            continue
+        
+        text_content.append(page_text)
+    return text_content
+
+def _log_and_wrap(pdf_path: str, error: Exception) -> Exception:
+    """Записывает ошибку в журнал и приводит непредвиденные ошибки к PDFParsingError"""
+    if isinstance(error, FileNotFoundError):
+        logger.error("Файл не найден: %s", pdf_path)
+        return error
+    if isinstance(error, PDFParsingError):
+        logger.error("Ошибка парсинга PDF: %s", error)
+        return error
+    error_msg = f"Непредвиденная ошибка при обработке PDF: {str(error)}"
+    logger.error(error_msg)
+    return PDFParsingError(error_msg)
+
+def extract_pages_from_pdf(pdf_path: str) -> List[str]:
+    """
+    Извлекает очищенный текст страниц PDF файла.
     
     Args:
         pdf_path (str): Путь к PDF файлу
         
     Returns:
-        str: Извлечённый текст
+        List[str]: Текст страниц в порядке документа (пустые и короткие страницы пропущены)
         
     Raises:
         PDFParsingError: Если возникла ошибка при обработке PDF
         FileNotFoundError: Если файл не найден
     """
     try:
-        # Проверяем существование файла
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError(f"Файл не найден: {pdf_path}")
+        total_pages = _open_pdf(pdf_path)
+        ranges, parallel = _page_ranges(total_pages)
         
-        # Проверяем расширение файла
-        if not pdf_path.lower().endswith('.pdf'):
-            raise PDFParsingError(f"Файл {pdf_path} не является PDF")
+        if parallel:
+            with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+                # Процессы пула создаются при первой отправке задачи: под блокировкой
+                # fork не застанет другой поток посреди вызова PDFium
+                with _PDFIUM_LOCK:
+                    futures = [
+                        executor.submit(_extract_page_range, pdf_path, start, stop)
+                        for start, stop in ranges
+                    ]
+                pages = [text for future in futures for text in future.result()]
+        else:
+            pages = _extract_page_range(pdf_path, 0, total_pages)
         
-        logger.info(f"Начало обработки файла: {pdf_path}")
-        
-        # Открываем и читаем PDF
-        text_content = []
-        with open(pdf_path, 'rb') as file:
-            try:
-                reader = PyPDF2.PdfReader(file)
-                
-                # Проверяем, зашифрован ли файл
-                if reader.is_encrypted:
-                    raise PDFParsingError("PDF файл зашифрован")
-                
-                # Извлекаем текст из каждой страницы
-                total_pages = len(reader.pages)
-                logger.info(f"Найдено страниц: {total_pages}")
-                
-                for page_num, page in enumerate(reader.pages, 1):
-                    try:
-                        logger.debug(f"Обработка страницы {page_num}/{total_pages}")
-                        page_text = page.extract_text()
-                        
-                        if not page_text:
-                            logger.warning(f"Страница {page_num} не содержит текста")
-                            continue
-                            
-                        text_content.append(page_text)
-                        
-                    except Exception as e:
-                        logger.error(f"Ошибка при обработке страницы {page_num}: {str(e)}")
-                        continue
-                
-            except PyPDF2.PdfReadError as e:
-                raise PDFParsingError(f"Ошибка чтения PDF: {str(e)}")
+        text_content = _clean_pages(pages, 1)
         
         # Проверяем, что удалось извлечь текст
         if not text_content:
             raise PDFParsingError("Не удалось извлечь текст из PDF файла")
         
-        # Объединяем текст всех страниц
-        result = "\n".join(text_content)
-        logger.info(f"Успешно извлечен текст из файла: {pdf_path}")
+        logger.info("Успешно извлечен текст из файла: %s", pdf_path)
+        return text_content
+        
+    except Exception as e:
+        raise _log_and_wrap(pdf_path, e)
+
+def extract_text_from_pdf(pdf_path: str) -> str:
+    """
+    Извлекает текст из PDF файла.
+    
+    Args:
+        pdf_path (str): Путь к PDF файлу
         
-        return result
+    Returns:
+        str: Извлечённый текст
+        
+    Raises:
+        PDFParsingError: Если возникла ошибка при обработке PDF
+        FileNotFoundError: Если файл не найден
+    """
+    # Объединяем текст всех страниц, разделяя их как абзацы
+    return "\n\n".join(extract_pages_from_pdf(pdf_path))
+
+async def aiter_pdf_pages(pdf_path: str) -> AsyncIterator[str]:
+    """
+    Асинхронно выдаёт очищенный текст страниц PDF по мере извлечения.
+    Диапазоны страниц обрабатываются в пуле процессов, и текст первого
+    диапазона доступен, пока остальные ещё извлекаются.
+    
+    Args:
+        pdf_path (str): Путь к PDF файлу
+        
+    Yields:
+        str: Текст очередной страницы в порядке документа
+        
+    Raises:
+        PDFParsingError: Если возникла ошибка при обработке PDF
+        FileNotFoundError: Если файл не найден
+    """
+    executor = None
+    try:
+        total_pages = await asyncio.to_thread(_open_pdf, pdf_path)
+        ranges, parallel = _page_ranges(total_pages)
+        if parallel:
+            executor = ProcessPoolExecutor(max_workers=len(ranges))
+        
+        loop = asyncio.get_running_loop()
+        # Как и в extract_pages_from_pdf, процессы пула создаются под блокировкой
+        with _PDFIUM_LOCK:
+            futures = [
+                loop.run_in_executor(executor, _extract_page_range, pdf_path, start, stop)
+                for start, stop in ranges
+            ]
+        
+        found = False
+        for (start, _), future in zip(ranges, futures):
+            for page_text in _clean_pages(await future, start + 1):
+                found = True
+                yield page_text
+        
+        # Проверяем, что удалось извлечь текст
+        if not found:
+            raise PDFParsingError("Не удалось извлечь текст из PDF файла")
+        logger.info("Успешно извлечен текст из файла: %s", pdf_path)
         
-    except FileNotFoundError:
-        logger.error(f"Файл не найден: {pdf_path}")
-        raise
-    except PDFParsingError as e:
-        logger.error(f"Ошибка парсинга PDF: {str(e)}")
-        raise
     except Exception as e:
-        error_msg = f"Непредвиденная ошибка при обработке PDF: {str(e)}"
-        logger.error(error_msg)
-        raise PDFParsingError(error_msg)
+        raise _log_and_wrap(pdf_path, e)
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
 
 def get_pdf_metadata(pdf_path: str) -> Dict[str, Any]:
     """
@@ -112,15 +297,18 @@ def get_pdf_metadata(pdf_path: str) -> Dict[str, Any]:
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"Файл не найден: {pdf_path}")
             
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            return {
-                'number_of_pages': len(reader.pages),
-                'metadata': reader.metadata or {},
-                'is_encrypted': reader.is_encrypted,
-                'file_size': os.path.getsize(pdf_path),
-                'file_name': os.path.basename(pdf_path)
-            }
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                return {
+                    'number_of_pages': len(pdf),
+                    'metadata': pdf.get_metadata_dict(skip_empty=True),
+                    'is_encrypted': _is_encrypted(pdf),
+                    'file_size': os.path.getsize(pdf_path),
+                    'file_name': os.path.basename(pdf_path)
+                }
+            finally:
+                pdf.close()
             
     except Exception as e:
         error_msg = f"Ошибка при получении метаданных PDF: {str(e)}"
@@ -144,11 +332,11 @@ def is_valid_pdf(file_path: str) -> bool:
         if not file_path.lower().endswith('.pdf'):
             return False
             
-        with open(file_path, 'rb') as file:
-            try:
-                PyPDF2.PdfReader(file)
-                return True
-            except:
-                return False
+        try:
+            with _PDFIUM_LOCK:
+                pdfium.PdfDocument(file_path).close()
+            return True
+        except:
+            return False
     except:
         return False
@@ -0,0 +1,48 @@
+# utils/prompts.py
+
+# Промпты собраны так, чтобы неизменная часть запроса шла первой, а данные дела
+# последними. OpenAI кэширует совпадающий побайтно префикс запроса, поэтому
+# системный промпт и контекст методики переиспользуются между вызовами.
+
+SYS_EXTRACTOR = "Ты опытный следователь который умеет выделять факты, события, участников, места и доказательства"
+
+SYS_PLANNER = "Ты опытный следователь, умеющий планировать расследование, использующий самые современные методики расследования"
+
+def _with_context(methodology_context: str, body: str) -> str:
+    """Ставит контекст методики перед переменной частью запроса"""
+    if not methodology_context:
+        return body
+    return f"{methodology_context}\n---\n{body}"
+
+def build_facts_prompt(case_description: str) -> str:
+    """Запрос на извлечение фактов: инструкция, затем фабула дела"""
+    return (
+        "Проанализируй текст фабулы дела и выдели ключевые факты "
+        "(даты, события, участников, места, доказательства). "
+        "Ответ должен быть в виде списка пунктов.\n"
+        f"Фабула: {case_description}"
+    )
+
+def build_plan_section_prompt(facts: str, instruction: str, methodology_context: str = "") -> str:
+    """
+    Запрос на один раздел плана. Контекст методики и факты одинаковы для всех
+    разделов, поэтому идут до инструкции раздела и образуют общий префикс
+    параллельных запросов.
+    """
+    return _with_context(
+        methodology_context,
+        f"Факты: {facts}\n\n"
+        "На основе фактов составь один раздел плана расследования. "
+        f"{instruction} Другие разделы плана не включай.\n"
+        "Ответ предоставь в виде структурированного списка."
+    )
+
+def build_batch_plan_prompt(case_description: str, methodology_context: str = "") -> str:
+    """Запрос на полный план по фабуле дела для пакетной обработки"""
+    return _with_context(
+        methodology_context,
+        f"Фабула: {case_description}\n\n"
+        "На основе фабулы дела выдели ключевые факты и составь план расследования, "
+        "включающий основные направления проверки, приоритетные действия и рекомендуемые экспертизы. "
+        "Ответ предоставь в виде структурированного плана."
+    )